@@ -214,6 +214,11 @@ class FunctionElementFixed(FunctionElement):
 class zdb_score(FunctionElementFixed):
     name = 'zdb_score'
 
+    def __init__(self, *criterion):
+        if len(criterion) != 1:
+            raise ValueError("Incorrect params")
+        super().__init__(*criterion)
+
 
 class zdb_raw_query(FunctionElementFixed):
     name = 'zdb_query'
@@ -228,9 +233,19 @@ class zdb_raw_query(FunctionElementFixed):
 class zdb_count(FunctionElementFixed):
     name = 'zdb_count'
 
+    def __init__(self, *criterion):
+        if len(criterion) != 2:
+            raise ValueError("Incorrect params, must be zdb_count(table, query)")
+        super().__init__(*criterion)
+
 
 class zdb_json_query(FunctionElementFixed):
     name = 'zdb_json_query'
 
+    def __init__(self, *criterion):
+        if len(criterion) != 2:
+            raise ValueError("Incorrect params, must be zdb_json_query(table, dict)")
+        super().__init__(*criterion)
+
 
 from sqlalchemy_zdb.compiler import compile_zdb_query
@@ -1,9 +1,6 @@
 import re
-import inspect
 import operator
-import psycopg2
 import json
-import sqlalchemy
 from sqlalchemy import Column
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import DeclarativeMeta
@@ -11,26 +8,34 @@ from sqlalchemy.sql.annotation import AnnotatedColumn
 from sqlalchemy.sql.elements import (
     BinaryExpression, BindParameter, TextClause, BooleanClauseList, Grouping,
     False_, True_, UnaryExpression, Null)
+from sqlalchemy.sql.operators import asc_op
 
 from sqlalchemy_zdb import zdb_raw_query, zdb_score, zdb_count, zdb_json_query
 from sqlalchemy_zdb.types import ZdbColumn, ZdbScore, ZdbLiteral, ZdbTable
 from sqlalchemy_zdb.operators import COMPARE_OPERATORS
 
 
+# TODO: figure out how to properly escape characters
+# like `'`, they seem to break up the query. For now
+# strip it.
+_ESCAPE_TOKENS = (
+    "\"",  ":",  "*",  "~", "?",  "!",
+    "%",  "&",  "(",  ")", ",",  "<",
+    "=",  ">",  "[",  "]", "^",  "{",
+    "}",  " ",  "\r", "\n", "\t", "\f")
+_ESCAPE_TRANS = str.maketrans({"'": None, **{t: "\\" + t for t in _ESCAPE_TOKENS}})
+
+
 def escape_tokens(inp):
-    # TODO: figure out how to properly escape characters
-    # like `'`, they seem to break up the query. For now
-    # replace it.
-    _escape_tokens = [
-       "'", "\"",  ":",  "*",  "~", "?",
-       "!",  "%",  "&",  "(",  ")", ",",
-       "<",  "=",  ">",  "[",  "]", "^",
-       "{",  "}",  " ",  "\r", "\n",
-       "\t", "\f"]
-    inp = inp.replace("\'", "")
-    for escape_token in _escape_tokens:
-        inp = inp.replace(escape_token, "\\%s" % escape_token)
-    return inp
+    return inp.translate(_ESCAPE_TRANS)
+
+
+def json_literal(value):
+    """
+    Serializes `value` for use inside a single quoted SQL
+    string.
+    """
+    return json.dumps(value).replace("'", "''")
 
 
 def compile_binary_clause(c, compiler, tables, format_args):
@@ -40,52 +45,66 @@ def compile_binary_clause(c, compiler, tables, format_args):
     if not isinstance(left, AnnotatedColumn):
         raise ValueError("Incorrect field")
 
-    _oper = COMPARE_OPERATORS.get(c.operator, None)
-    if _oper is None:
-        raise ValueError("Unsupported binary operator %s" % c.operator)
+    try:
+        _oper = COMPARE_OPERATORS[c.operator]
+    except KeyError:
+        raise ValueError(f"Unsupported binary operator {c.operator}")
 
-    tables.add(left.table.name)
+    if tables[0] is None:
+        tables[0] = left.table.name
+    elif tables[0] != left.table.name:
+        raise ValueError("Different tables passed")
 
-    if inspect.isfunction(_oper):
-        return _oper(left, right, c, compiler, tables, format_args)
+    if isinstance(_oper, str):
+        return f'{left.name}{_oper}{compile_clause(right, compiler, tables, format_args)}'
     else:
-        return '%s%s%s' % (left.name, _oper, compile_clause(right, compiler, tables, format_args))
+        return _oper(left, right, c, compiler, tables, format_args)
 
 
-def compile_boolean_clause_list(c, compiler, tables, format_args):
-    query = []
+_BOOLEAN_OPERATORS = {
+    operator.or_: " or ",
+    operator.and_: " and ",
+}
 
-    for _c in c.clauses:
-        query.append(compile_clause(_c, compiler, tables, format_args))
 
-    if c.operator == operator.or_:
-        _oper = " or "
-    elif c.operator == operator.and_:
-        _oper = " and "
-    else:
+def boolean_clause_operator(c):
+    try:
+        return _BOOLEAN_OPERATORS[c.operator]
+    except KeyError:
         raise ValueError("Unsupported boolean clause")
 
-    return "(%s)" % _oper.join(query)
-
 
 def compile_column_clause(c, compiler, tables, format_args):
-    format_args.append("replace(%s, '\"', '')" % compiler.process(c))
+    format_args.append(f"replace({compiler.process(c)}, '\"', '')")
     return "\"%%s\""
 
 
-def compile_grouping(c, compiler, tables, format_args):
-    sql = "(%s)"
-    values = []
-    for elem in c.element:
-        if isinstance(elem.value, str):
-            val = "\"%s\"" % elem.value
-        elif isinstance(elem.value, int):
-            val = str(elem.value)
+def resolve_handler(dispatch, c, error):
+    handler = dispatch.get(type(c))
+    if handler is None:
+        # subclasses (e.g. annotated columns) resolve once, then hit the fast path
+        for _type, _handler in list(dispatch.items()):
+            if isinstance(c, _type):
+                handler = dispatch[type(c)] = _handler
+                break
         else:
-            raise Exception("Unsupported type for IN")
-        values.append(val)
+            raise ValueError(error)
+    return handler
+
+
+_IN_VALUE_RENDER = {
+    str: lambda v: f"\"{v}\"",
+    int: str,
+}
+
 
-    return sql % ",".join(values)
+def compile_grouping(c, compiler, tables, format_args):
+    values = (resolve_handler(_IN_VALUE_RENDER, e.value, "Unsupported type for IN")(e.value)
+              for e in c.element)
+    return f"({','.join(values)})"
+
+
+_get_base_columns = operator.attrgetter("element.base_columns")
 
 
 def compile_limit(offset: int, limit: int, order_by=None):
@@ -99,146 +118,157 @@ def compile_limit(offset: int, limit: int, order_by=None):
     if not isinstance(offset, int) or not isinstance(limit, int):
         raise Exception("Expected int for zdb LIMIT offset and/or limit")
 
-    # dirty hack, UnaryExpression doesnt implement boolean clause comparison
-    if type(order_by) == type(None):
+    # identity check, UnaryExpression doesnt implement boolean clause comparison
+    if order_by is None:
         raise Exception("Expected UnaryExpression or ZdbScore for zdb LIMIT")
     if isinstance(order_by, ZdbScore):
         column_name = "_score"
         direction = order_by._zdb_direction
     elif isinstance(order_by, UnaryExpression):
-        column = next(iter(order_by.element.base_columns))
+        column = next(iter(_get_base_columns(order_by)))
         column_name = column.name
-        direction = "asc" if order_by.modifier == sqlalchemy.sql.operators.asc_op else "desc"
+        direction = "asc" if order_by.modifier is asc_op else "desc"
 
-        if not type(column) == ZdbColumn:
+        if type(column) is not ZdbColumn:
             raise Exception("Expected ZdbColumn for zdb LIMIT")
     else:
         raise Exception("Unexpected expression")
 
-    return "#limit(%s %s, %d, %d) " % (column_name, direction, offset, limit)
+    return f"#limit({column_name} {direction}, {offset:d}, {limit:d}) "
+
+
+_BIND_VALUE_DISPATCH = {
+    str: lambda v: f"\"{escape_tokens(v)}\"",
+    int: lambda v: v,
+    re.Pattern: lambda v: f"\"{v.pattern}\"",
+    ZdbLiteral: lambda v: v.literal,
+}
+
+
+def compile_bind_parameter(c, compiler, tables, format_args):
+    # dispatches on the type of the bound value, not the clause
+    return resolve_handler(_BIND_VALUE_DISPATCH, c.value, "Unsupported clause")(c.value)
+
+
+_CLAUSE_DISPATCH = {
+    BindParameter: compile_bind_parameter,
+    True_: lambda *_: "true",
+    False_: lambda *_: "false",
+    TextClause: lambda c, *_: c.text,
+    BinaryExpression: compile_binary_clause,
+    Column: compile_column_clause,
+    Grouping: compile_grouping,
+    Null: lambda *_: "NULL",
+    ZdbTable: lambda c, *_: c.table,
+}
 
 
 def compile_clause(c, compiler, tables, format_args):
-    if isinstance(c, BindParameter) and isinstance(c.value, (
-            str, int, re._pattern_type, ZdbLiteral)):
-        if isinstance(c.value, str):
-            return "\"%s\"" % escape_tokens(c.value)
-        elif isinstance(c.value, re._pattern_type):
-            return "\"%s\"" % c.value.pattern
-        elif isinstance(c.value, ZdbLiteral):
-            return c.value.literal
+    """
+    Compiles a clause tree without recursing into nested
+    and/or lists. Their children are pushed on a stack behind
+    an (operator, child count) marker, which joins the
+    rendered children once they have all been compiled.
+    """
+    results = []
+    stack = [c]
+
+    while stack:
+        node = stack.pop()
+
+        if type(node) is tuple:
+            _oper, count = node
+            start = len(results) - count
+            results[start:] = [f"({_oper.join(results[start:])})"]
+        elif isinstance(node, BooleanClauseList):
+            stack.append((boolean_clause_operator(node), len(node.clauses)))
+            stack.extend(reversed(node.clauses))
         else:
-            return c.value
-    elif isinstance(c, (True_, False_)):
-        return str(type(c) == True_).lower()
-    elif isinstance(c, TextClause):
-        return c.text
-    elif isinstance(c, BinaryExpression):
-        return compile_binary_clause(c, compiler, tables, format_args)
-    elif isinstance(c, BooleanClauseList):
-        return compile_boolean_clause_list(c, compiler, tables, format_args)
-    elif isinstance(c, Column):
-        return compile_column_clause(c, compiler, tables, format_args)
-    elif isinstance(c, Grouping):
-        return compile_grouping(c, compiler, tables, format_args)
-    elif isinstance(c, Null):
-        return "NULL"
-    elif isinstance(c, ZdbTable):
-        return c.table
-    raise ValueError("Unsupported clause")
+            handler = resolve_handler(_CLAUSE_DISPATCH, node, "Unsupported clause")
+            results.append(handler(node, compiler, tables, format_args))
+
+    return results[0]
+
+
+def _check_bind_filter(c):
+    if hasattr(c.value, 'table'):
+        raise ValueError("Table can be specified only as first param")
+
+
+def _check_filter(c):
+    pass
+
+
+# top level clauses accepted by zdb_raw_query
+_FILTER_CHECKS = {
+    BinaryExpression: _check_filter,
+    BindParameter: _check_bind_filter,
+    BooleanClauseList: _check_filter,
+    Column: _check_filter,
+}
 
 
 @compiles(zdb_raw_query)
 def compile_zdb_query(element, compiler, **kw):
     query = []
-    tables = set()
+    # single slot, a zdb query only ever targets one table
+    tables = [None]
     format_args = []
     limit = ""
 
-    for i, c in enumerate(element.clauses):
-        add_to_query = True
-
-        if isinstance(c, BinaryExpression):
-            tables.add(c.left.table.name)
-        elif isinstance(c, BindParameter):
-            if isinstance(c.value, str):
-                pass
-            elif hasattr(c.value, 'table'):
-                if i > 0:
-                    raise ValueError("Table can be specified only as first param")
-                tables.add(c.value.table.__tablename__)
-                add_to_query = False
-        elif isinstance(c, BooleanClauseList):
-            pass
-        elif isinstance(c, Column):
-            pass
-        else:
-            raise ValueError("Unsupported filter")
+    clauses = element.clauses.clauses
+
+    # the table may only be passed as the first param
+    if clauses and isinstance(clauses[0], BindParameter) and hasattr(clauses[0].value, 'table'):
+        tables[0] = clauses[0].value.table.__tablename__
+        clauses = clauses[1:]
 
-        if add_to_query:
-            query.append(compile_clause(c, compiler, tables, format_args))
+    for c in clauses:
+        resolve_handler(_FILTER_CHECKS, c, "Unsupported filter")(c)
 
-    if not tables:
+        # binary clauses register their table while compiling
+        query.append(compile_clause(c, compiler, tables, format_args))
+
+    table = tables[0]
+    if table is None:
         raise ValueError("No filters passed")
-    elif len(tables) > 1:
-        raise ValueError("Different tables passed")
-    else:
-        table = tables.pop()
 
     if hasattr(element, "_zdb_order_by") and isinstance(element._zdb_order_by, (UnaryExpression, ZdbScore)):
         limit = compile_limit(order_by=element._zdb_order_by,
                               offset=element._zdb_offset,
                               limit=element._zdb_limit)
 
-    sql = "%s ==> " % table
-    if format_args and isinstance(format_args, list):
-        sql += "'%sformat('%s', %s)'" % (
-            limit,
-            " and ".join(query),
-            ", ".join(format_args)
-        )
-    else:
-        sql += "'%s%s'" % (
-            limit,
-            " and ".join(query))
-    return sql
+    query = " and ".join(query)
+    if format_args:
+        query = f"format('{query}', {', '.join(format_args)})"
+    return f"{table} ==> '{limit}{query}'"
 
 
 @compiles(zdb_score)
 def compile_zdb_score(element, compiler, **kw):
-    clauses = list(element.clauses)
-    if len(clauses) != 1:
-        raise ValueError("Incorrect params")
-
-    c = clauses[0]
+    c = element.clauses.clauses[0]
     if isinstance(c, BindParameter) and isinstance(c.value, DeclarativeMeta):
-        return "zdb_score(\'%s\', %s.ctid)" % (c.value.__tablename__, c.value.__tablename__)
+        return f"zdb_score('{c.value.__tablename__}', {c.value.__tablename__}.ctid)"
 
     raise ValueError("Incorrect param")
 
 
 @compiles(zdb_count)
 def compile_zdb_count(element, compiler, **kw):
-    clauses = list(element.clauses)
-    if len(clauses) != 2:
-        raise ValueError("Incorrect params, must be zdb_count(table, query)")
+    clauses = element.clauses.clauses
 
     table = clauses[0].value.table.__tablename__
-    query = json.dumps(clauses[1].value)
-    query = query.replace("'", "''")
+    query = json_literal(clauses[1].value)
 
-    return "zdb.count('%s', '%s')" % (table, query)
+    return f"zdb.count('{table}', '{query}')"
 
 
 @compiles(zdb_json_query)
 def compile_zdb_json(element, compiler, **kw):
-    clauses = list(element.clauses)
-    if len(clauses) != 2:
-        raise ValueError("Incorrect params, must be zdb_json_query(table, dict)")
+    clauses = element.clauses.clauses
 
     table = clauses[0].value.table.__tablename__
 
-    query = json.dumps(clauses[1].value)
-    query = query.replace("'", "''")
+    query = json_literal(clauses[1].value)
 
-    return "%s ==> '%s'" % (table, query)
+    return f"{table} ==> '{query}'"
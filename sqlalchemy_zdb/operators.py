@@ -46,12 +46,12 @@ def zdb_like_op(left, right, c, compiler, tables, format_args):
     """
     from sqlalchemy_zdb.compiler import compile_clause
 
-    if isinstance(right.value, re._pattern_type):
+    if type(right.value) is re.Pattern:
         _oper = ":~"
     else:
         _oper = ":"
 
-    return "%s%s%s" % (left.name, _oper, compile_clause(right, compiler, tables, format_args))
+    return f"{left.name}{_oper}{compile_clause(right, compiler, tables, format_args)}"
 
 
 def zdb_in_op(left, right, c, compiler, tables, format_args):
@@ -59,7 +59,7 @@ def zdb_in_op(left, right, c, compiler, tables, format_args):
     from sqlalchemy_zdb.compiler import compile_clause
 
     _oper = ":"
-    return "%s%s%s" % (left.name, _oper, compile_clause(right, compiler, tables, format_args))
+    return f"{left.name}{_oper}{compile_clause(right, compiler, tables, format_args)}"
 
 
 COMPARE_OPERATORS = {
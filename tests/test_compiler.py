@@ -0,0 +1,85 @@
+from sqlalchemy import Column, Unicode, and_, or_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import BIGINT
+# plain declarative_base, the one patched by sqlalchemy_zdb would
+# hook these models into the create_all of tests.models
+from sqlalchemy.ext.declarative.api import declarative_base
+
+from tests.models import Products
+from tests.conftest import validate_sql
+from sqlalchemy_zdb import zdb_raw_query
+from sqlalchemy_zdb.types import ZdbColumn
+
+schema_base = declarative_base()
+
+
+class SchemaAProducts(schema_base):
+    __tablename__ = "products"
+    __table_args__ = {"schema": "a"}
+
+    id = Column(BIGINT, nullable=False, primary_key=True)
+    name = Column(Unicode())
+    author = ZdbColumn(Unicode(32))
+
+
+class SchemaBProducts(schema_base):
+    __tablename__ = "products"
+    __table_args__ = {"schema": "b"}
+
+    id = Column(BIGINT, nullable=False, primary_key=True)
+    name = Column(Unicode())
+    author = ZdbColumn(Unicode(32))
+
+
+def compile_query(clause):
+    return str(clause.compile(dialect=postgresql.dialect()))
+
+
+def test_same_shape_queries():
+    sql = compile_query(zdb_raw_query(
+        Products.author == "foo",
+        Products.price == 10,
+        Products.author.in_(["a", "b"])))
+    assert validate_sql(sql, target="""
+products ==> 'author:"foo" and price:10 and author:("a","b")'
+    """) is True
+
+    sql = compile_query(zdb_raw_query(
+        Products.author == "bar baz",
+        Products.price == 20,
+        Products.author.in_(["c"])))
+    assert validate_sql(sql, target=r"""
+products ==> 'author:"bar\ baz" and price:20 and author:("c")'
+    """) is True
+
+
+def test_schema_tables():
+    sql = compile_query(zdb_raw_query(SchemaAProducts.author == SchemaAProducts.name))
+    assert validate_sql(sql, target="""
+products ==> 'format('author:"%%s"', replace(a.products.name, '"', ''))'
+    """) is True
+
+    sql = compile_query(zdb_raw_query(SchemaBProducts.author == SchemaBProducts.name))
+    assert validate_sql(sql, target="""
+products ==> 'format('author:"%%s"', replace(b.products.name, '"', ''))'
+    """) is True
+
+
+def test_nul_in_bind():
+    sql = compile_query(zdb_raw_query(Products.author == "x\x00y"))
+    assert validate_sql(sql, target="""
+products ==> 'author:"x\x00y"'
+    """) is True
+
+
+def test_nested_boolean_clauses():
+    clause = Products.author == "a99"
+    target = 'author:"a99"'
+    for i in reversed(range(99)):
+        clause = and_(Products.author == f"a{i}", clause)
+        target = f'(author:"a{i}" and {target})'
+
+    sql = compile_query(zdb_raw_query(or_(Products.price == 1, clause)))
+    assert validate_sql(sql, target=f"""
+products ==> '(price:1 or {target})'
+    """) is True